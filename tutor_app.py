@@ -1,13 +1,55 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import hashlib
+import io
+import itertools
+import mimetypes
+import re
+import threading
+import time
+
 import streamlit as st
 import google.generativeai as genai
+from google.generativeai import caching, client
+from google.generativeai.types import file_types
 
 # --- Page Configuration ---
+# The lighter centered layout is enough until a tutor has been generated
 st.set_page_config(
     page_title="Adaptive AI Tutor",
     page_icon="🎓",
-    layout="wide"
+    layout="wide" if "gemini_chat" in st.session_state else "centered"
 )
 
+# The Gemini model backing the tutor
+MODEL_NAME = 'gemini-2.5-flash-preview-05-20'
+# At most this many API keys keep a cached model (and its gRPC clients) around
+MAX_CACHED_MODELS = 32
+
+# The File API keeps uploads for 48 hours; uploads are reused for a little less than that
+MATERIALS_UPLOAD_TTL = datetime.timedelta(hours=47)
+# Lifetime of the server-side context cache holding the uploaded materials; a session in
+# use pushes it back whenever less than MATERIALS_CACHE_MARGIN is left
+MATERIALS_CACHE_TTL = datetime.timedelta(hours=1)
+MATERIALS_CACHE_MARGIN = datetime.timedelta(minutes=10)
+
+# Only the tutor prompt plus the last HISTORY_WINDOW exchanges are resent each turn
+HISTORY_WINDOW = 6
+# Exchanges that slide out of the window are condensed into a summary every SUMMARY_EVERY of them
+SUMMARY_EVERY = 8
+
+# The chat transcript keeps at most MAX_MESSAGES; only the last RECENT_MESSAGES are shown
+# by default, older ones are rendered only on request
+MAX_MESSAGES = 200
+RECENT_MESSAGES = 30
+
+# Replies are cached across sessions, keyed by the prompt and the history it was sent with
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 3600
+
 # --- The Core Prompt Template ---
 # This is the refined prompt we developed, now as a configurable string.
 PROMPT_TEMPLATE = """
@@ -40,9 +82,10 @@ After analyzing the initial context, you will begin generating practice quizzes
 **B. Grading and Feedback:**
 
 1.  I will provide my answers. You will grade them meticulously, providing a score.
-2.  For each correct question, simply write "Correct!" and a brief summary of the logic used. For incorrect questions, mark them as "Incorrect!" and explain why, providing correct logic. Acknowledge the reasoning in my answers, even if they are incorrect. 
-3.  Internally, keep track of which topics are "Review", "Working", and "New", promoting or demoting topics based on how many answers for each have been correct. Typically, a "Review" question is one that has recieved 5+ correct answers. A "Working" question has between 2 and 5 correct answers. A "New" topic has between 0 and 2 correct answers.
-4.  After grading, provide a brief, encouraging "Final Score & Summary".
+2.  Several of my messages may reach you joined together in one message. Grade all of the answers I have submitted together in a single response, question by question.
+3.  For each correct question, simply write "Correct!" and a brief summary of the logic used. For incorrect questions, mark them as "Incorrect!" and explain why, providing correct logic. Acknowledge the reasoning in my answers, even if they are incorrect. 
+4.  Internally, keep track of which topics are "Review", "Working", and "New", promoting or demoting topics based on how many answers for each have been correct. Typically, a "Review" question is one that has recieved 5+ correct answers. A "Working" question has between 2 and 5 correct answers. A "New" topic has between 0 and 2 correct answers.
+5.  After grading, provide a brief, encouraging "Final Score & Summary".
 
 **IV. Special Commands and Meta-Interaction**
 
@@ -56,6 +99,318 @@ Our interaction is successful when I have achieved a perfect score on three cons
 **Your first message to me should be a brief, welcoming greeting, confirming you have understood the context and are ready to begin with the first targeted quiz.**
 """
 
+# Split the template once at import time around its placeholders, so rendering is a
+# plain join instead of a str.format parse. Literal chunks sit at the even indices and
+# placeholder names at the odd ones, so the template's field order can change freely.
+PROMPT_PARTS: tuple[str, ...] = tuple(
+    re.split(r"\{(class_name|file_names_str|topic_list)\}", PROMPT_TEMPLATE)
+)
+
+# --- Helpers ---
+
+async def warm_up(model):
+    """Send a tiny request through the async client so its connection is open when the tutor is generated."""
+    try:
+        await model.generate_content_async("ping", generation_config={"max_output_tokens": 1})
+    except Exception:
+        # Best effort only; a bad key is reported when "Generate Tutor" is clicked
+        pass
+
+@st.cache_data(show_spinner=False)
+def normalize_topics(raw: str) -> str:
+    """Strip each topic line and drop blank ones, so cosmetic whitespace edits don't change the prompt."""
+    return "\n".join(line.strip() for line in raw.splitlines() if line.strip())
+
+def hash_files(uploaded_files):
+    """Return a (name, sha256) pair per uploaded file, reading and hashing them in parallel."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        return list(executor.map(
+            lambda file: (file.name, hashlib.sha256(file.getbuffer()).hexdigest()),
+            uploaded_files
+        ))
+
+def _upload_file(file_client, file):
+    return file_types.File(file_client.create_file(
+        io.BytesIO(file.getvalue()),
+        mime_type=mimetypes.guess_type(file.name)[0] or file.type,
+        display_name=file.name
+    ))
+
+@st.cache_resource(show_spinner=False, ttl=MATERIALS_UPLOAD_TTL)
+def upload_materials(api_key: str, file_digests: tuple, _uploaded_files):
+    """Upload the course files to the Gemini File API in parallel, once per API key and set of file contents."""
+    # Only building the key's file client needs the global configuration; the uploads run unlocked
+    with gemini_key(api_key):
+        file_client = client.get_default_file_client()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        return list(executor.map(lambda file: _upload_file(file_client, file), _uploaded_files))
+
+@st.cache_resource(show_spinner=False, ttl=MATERIALS_CACHE_TTL - MATERIALS_CACHE_MARGIN)
+def get_materials_cache(api_key: str, model_name: str, file_digests: tuple, _files):
+    """Cache the uploaded materials server-side, so each turn doesn't make Gemini reprocess them.
+
+    Returns None when they can't be cached; that outcome is remembered too, so a failing
+    request isn't repeated on every "Generate Tutor" click.
+    """
+    try:
+        with gemini_key(api_key):
+            return caching.CachedContent.create(model=model_name, contents=_files, ttl=MATERIALS_CACHE_TTL)
+    except Exception:
+        # Context caching needs a minimum amount of content and isn't offered for every model
+        return None
+
+def _cache_time_left(materials_cache):
+    return materials_cache.expire_time - datetime.datetime.now(datetime.timezone.utc)
+
+def refresh_materials_cache(api_key):
+    """Keep this session's materials cache usable through long or idle sessions.
+
+    The cache is extended when it is close to expiring. Once the server has dropped it, a
+    new one is built and the chat moved onto it; if caching fails now, the files are
+    attached to the first turn of the chat history instead.
+    """
+    materials_cache = st.session_state.materials_cache
+    remaining = _cache_time_left(materials_cache)
+    if remaining >= MATERIALS_CACHE_MARGIN:
+        return
+    if remaining > datetime.timedelta(0):
+        try:
+            with gemini_key(api_key):
+                materials_cache.update(ttl=MATERIALS_CACHE_TTL)
+            return
+        except Exception:
+            # Expired in the meantime; rebuilt below
+            pass
+
+    files = st.session_state.materials_files
+    digests = st.session_state.materials_digests
+    materials_cache = get_materials_cache(api_key, MODEL_NAME, digests, files)
+    if materials_cache is not None and _cache_time_left(materials_cache) <= datetime.timedelta(0):
+        # The memoized entry is the expired cache itself
+        get_materials_cache.clear()
+        materials_cache = get_materials_cache(api_key, MODEL_NAME, digests, files)
+
+    history = st.session_state.gemini_chat.history
+    if materials_cache is None:
+        model = st.session_state.gemini_model
+        first = history[0]
+        history = [{"role": first.role, "parts": [*files, *first.parts]}] + history[1:]
+    else:
+        model = bind_clients(genai.GenerativeModel.from_cached_content(cached_content=materials_cache), api_key)
+    st.session_state.materials_cache = materials_cache
+    st.session_state.gemini_chat = model.start_chat(history=history)
+
+@st.cache_data(show_spinner=False)
+def render_prompt(class_name: str, topic_list: str, file_names_str: str) -> str:
+    """Fill in the tutor prompt, memoized on its inputs across reruns."""
+    fields = {"class_name": class_name, "file_names_str": file_names_str, "topic_list": topic_list}
+    return "".join([fields[part] if i % 2 else part for i, part in enumerate(PROMPT_PARTS)])
+
+@st.cache_resource(show_spinner=False, max_entries=MAX_CACHED_MODELS)
+def get_model(api_key: str, model_name: str):
+    """Build the model once per API key, instead of on every rerun."""
+    return bind_clients(genai.GenerativeModel(model_name), api_key)
+
+@st.cache_resource(show_spinner=False)
+def _sdk_config_lock():
+    return threading.Lock()
+
+@contextlib.contextmanager
+def gemini_key(api_key):
+    """Hold the SDK's global configuration on `api_key` for the duration of the block.
+
+    `genai.configure` is process-wide and the SDK's default clients are built lazily from
+    whichever key was configured last, so every use of them must go through here.
+    """
+    with _sdk_config_lock():
+        genai.configure(api_key=api_key)
+        yield
+
+async def _default_async_client():
+    # Built on the shared loop, which its gRPC channel binds to
+    return client.get_default_generative_async_client()
+
+def bind_clients(model, api_key):
+    """Give `model` its own SDK clients for `api_key` now, rather than on first use under whatever key is current."""
+    with gemini_key(api_key):
+        model._client = client.get_default_generative_client()
+        model._async_client = run_async(_default_async_client())
+    return model
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop():
+    """Start the process-wide event loop that all async SDK calls run on, in a background thread.
+
+    The SDK's async gRPC client is shared by every session and stays bound to the loop it
+    was first used on, so there must be exactly one loop, and it must outlive any session.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """Run `coro` on the shared event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+def _stream_texts(response):
+    """Yield the text of each chunk of an async streamed response, pulled on the shared loop."""
+    chunks = response.__aiter__()
+
+    async def next_chunk():
+        return await chunks.__anext__()
+
+    while True:
+        try:
+            chunk = run_async(next_chunk())
+        except StopAsyncIteration:
+            return
+        yield chunk.text
+
+class ResponseCache:
+    """A thread-safe LRU of reply texts whose entries expire `ttl` seconds after being stored."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, reply = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return reply
+
+    def put(self, key, reply):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+def response_key(api_key, chat, parts):
+    """Hash the API key, the model and its cached context, the chat history so far and the outgoing `parts` into a response cache key."""
+    digest = hashlib.blake2b(digest_size=16)
+    # The cache is shared by all sessions; a reply is only served back under the key that paid for it
+    digest.update(hashlib.sha256(api_key.encode()).digest())
+    digest.update(chat.model.model_name.encode())
+    digest.update(str(getattr(chat.model, "cached_content", None)).encode())
+    for content in chat.history:
+        digest.update(type(content).serialize(content))
+    for part in parts:
+        # Uploaded files are identified by their File API name
+        digest.update((part if isinstance(part, str) else part.name).encode())
+    return digest.hexdigest()
+
+def stream_reply(chat, prompt, container, api_key, attachments=()):
+    """Send `prompt` to the chat, render the reply into `container` as it streams and return it as a message.
+
+    `attachments` are File API uploads sent along with the prompt. Replies are looked up in
+    the shared response cache first; a hit is rendered at once and recorded in the chat
+    history as if it had been sent. The message carries the reply's latency and, for
+    replies fresh from Gemini, its token counts.
+    """
+    t0 = time.perf_counter()
+    parts = [*attachments, prompt]
+    key = response_key(api_key, chat, parts)
+    cache = get_response_cache()
+    reply = cache.get(key)
+    usage = None
+    if reply is None:
+        reply, usage = _send_and_stream(chat, parts, container)
+        cache.put(key, reply)
+    else:
+        container.markdown(reply)
+        chat.history = chat.history + [
+            {"role": "user", "parts": parts},
+            {"role": "model", "parts": [reply]},
+        ]
+    return {
+        "role": "assistant",
+        "content": reply,
+        "latency_ms": round((time.perf_counter() - t0) * 1000),
+        "tok_in": getattr(usage, "prompt_token_count", None),
+        "tok_out": getattr(usage, "candidates_token_count", None),
+    }
+
+def _send_and_stream(chat, parts, container):
+    response = run_async(chat.send_message_async(parts, stream=True))
+    return container.write_stream(_stream_texts(response)), response.usage_metadata
+
+def _content_text(content):
+    return "".join(part.text for part in content.parts)
+
+def trim_history(chat, model):
+    """Trim the chat history to the tutor prompt plus the last HISTORY_WINDOW exchanges.
+
+    Exchanges that fall out of the window are buffered and, once SUMMARY_EVERY of them
+    have piled up, condensed into a running summary kept right after the tutor prompt.
+    """
+    history = chat.history
+    summary = st.session_state.history_summary
+    # The first exchange is the tutor prompt and greeting; the summary exchange, if any, follows it
+    head, body = history[:2], history[4 if summary else 2:]
+    overflow = len(body) - 2 * HISTORY_WINDOW
+    if overflow <= 0:
+        return
+
+    # The dropped turns are only recorded once everything below has succeeded; if the summary
+    # call fails the history stays untrimmed and the same turns are retried next time
+    dropped = st.session_state.dropped_turns + [
+        f"{content.role}: {_content_text(content)}" for content in body[:overflow]
+    ]
+    if len(dropped) >= 2 * SUMMARY_EVERY:
+        transcript = "\n\n".join(([f"Summary so far: {summary}"] if summary else []) + dropped)
+        response = run_async(model.generate_content_async(
+            "Summarize this excerpt of a tutoring session, keeping the student's performance on each topic:\n\n"
+            + transcript
+        ))
+        summary = st.session_state.history_summary = response.text
+        dropped = []
+    st.session_state.dropped_turns = dropped
+
+    recap = [
+        {"role": "user", "parts": ["Summarize our session so far."]},
+        {"role": "model", "parts": [summary]},
+    ] if summary else []
+    chat.history = head + recap + body[overflow:]
+
+def restore_interrupted_send(chat):
+    """Roll the chat history back if the last send never finished.
+
+    A rerun (a new chat input, a sidebar or toggle change) can interrupt a reply mid-stream,
+    leaving the chat holding a half-read response that makes every later history access fail.
+    The unanswered text stays in `pending_input` and is sent again by the chat interface.
+    """
+    if st.session_state.send_in_flight:
+        chat.history = st.session_state.history_before_send
+        st.session_state.send_in_flight = False
+
+def queue_chat_input():
+    """Record a submitted chat message and queue it for the chat fragment to send."""
+    prompt = st.session_state.chat_input
+    st.session_state.messages.append({"role": "user", "content": prompt})
+    st.session_state.pending_input.append(prompt)
+
+def render_message(msg):
+    with st.chat_message(msg["role"]):
+        st.markdown(msg["content"])
+        if st.session_state.get("debug") and msg.get("latency_ms") is not None:
+            caption = f"{msg['latency_ms']} ms"
+            if msg.get("tok_out") is not None:
+                caption += f" · {msg['tok_in']} → {msg['tok_out']} tok"
+            st.caption(caption)
+
 # --- App Layout and Logic ---
 
 st.title("🎓 Adaptive AI Tutor Generator")
@@ -67,10 +422,15 @@ with st.sidebar:
     
     # API Key Input
     api_key = st.text_input("Enter your Gemini API Key", type="password")
+    if api_key and api_key != st.session_state.get("warmed_key"):
+        # Warm up in the background on the shared loop, through the same async channel the
+        # tutor uses, so the first real request starts hot
+        asyncio.run_coroutine_threadsafe(warm_up(get_model(api_key, MODEL_NAME)), get_event_loop())
+        st.session_state.warmed_key = api_key
     
     # Class and Topic Inputs
     class_name = st.text_input("Course Name", value="CSE 130: Principles of Computer Systems Design")
-    topic_list = st.text_area(
+    topic_list = normalize_topics(st.text_area(
         "Core Topics List",
         value="""- Performance: Amdahl's Law, Latency vs. Throughput
 - Caching & Memory: LRU, FIFO, Clock, Associativity, Write-Through/Back
@@ -78,7 +438,8 @@ with st.sidebar:
 - System Organization: Hard/Soft Modularity, RPCs
 - Low-Level Details: "Find the Bugs" in C I/O, Critical Sections""",
         height=250
-    )
+    ))
+    st.toggle("Show response timings", key="debug")
     st.markdown("---")
     st.info("Your API key is used only for this session and is not stored.")
 
@@ -99,69 +460,124 @@ with main_container:
         elif not class_name or not topic_list:
             st.error("Please provide the Course Name and Topic List.")
         else:
-            with st.spinner("Configuring your personal AI tutor... This may take a moment."):
-                try:
-                    # Configure the Generative AI library
-                    genai.configure(api_key=api_key)
-
-                    # Get names of uploaded files for the prompt
-                    file_names = [file.name for file in uploaded_files]
-                    if not file_names:
-                        file_names_str = "No files provided. Using topic list only."
+            try:
+                # Get names and content hashes of uploaded files for the prompt
+                file_hashes = hash_files(uploaded_files)
+                file_names = [name for name, _ in file_hashes]
+                if not file_names:
+                    file_names_str = "No files provided. Using topic list only."
+                else:
+                    file_names_str = ", ".join(file_names)
+
+                # Format the final prompt
+                final_prompt = render_prompt(class_name, topic_list, file_names_str)
+
+                # Initialize the model (cached per API key)
+                model = get_model(api_key, MODEL_NAME)
+
+                # Upload the materials so the tutor sees their content. When possible they are
+                # cached server-side and baked into the model; otherwise they are attached to
+                # the first message and carried along in the history.
+                tutor_model = model
+                materials_cache = None
+                file_digests = ()
+                files = []
+                attachments = []
+                if file_hashes:
+                    file_digests = tuple(digest for _, digest in file_hashes)
+                    files = upload_materials(api_key, file_digests, uploaded_files)
+                    materials_cache = get_materials_cache(api_key, MODEL_NAME, file_digests, files)
+                    if materials_cache is None:
+                        attachments = files
                     else:
-                        file_names_str = ", ".join(file_names)
-
-                    # Format the final prompt
-                    final_prompt = PROMPT_TEMPLATE.format(
-                        class_name=class_name,
-                        topic_list=topic_list,
-                        file_names_str=file_names_str
-                    )
-
-                    # Initialize the model and chat
-                    model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
-                    chat = model.start_chat(history=[])
-                    
-                    # Send the system prompt to initialize the tutor
-                    # This is the key step to set the context for the entire conversation.
-                    initial_response = chat.send_message(final_prompt)
-                    
-                    # Store the chat session and initial messages in Streamlit's session state
-                    st.session_state.gemini_chat = chat
-                    st.session_state.messages = [{"role": "assistant", "content": initial_response.text}]
-                    
-                    st.success("Tutor generated successfully! You can now start chatting below.")
-                    st.balloons()
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
-                    st.info("Please check your API key and ensure it has access to the Gemini 1.5 Pro model.")
+                        tutor_model = bind_clients(
+                            genai.GenerativeModel.from_cached_content(cached_content=materials_cache), api_key
+                        )
+                chat = tutor_model.start_chat(history=[])
+
+                # Send the system prompt to initialize the tutor
+                # This is the key step to set the context for the entire conversation.
+                # The reply is streamed into a temporary preview, which doubles as the
+                # progress indicator; the chat interface below renders it for good.
+                preview = st.empty()
+                initial_msg = stream_reply(chat, final_prompt, preview.chat_message("assistant"), api_key, attachments)
+                preview.empty()
+
+                # Store the chat session and initial messages in Streamlit's session state
+                st.session_state.gemini_api_key = api_key
+                st.session_state.gemini_model = model
+                st.session_state.materials_cache = materials_cache
+                st.session_state.materials_files = files
+                st.session_state.materials_digests = file_digests
+                st.session_state.gemini_chat = chat
+                st.session_state.history_summary = None
+                st.session_state.dropped_turns = []
+                st.session_state.pending_input = []
+                st.session_state.send_in_flight = False
+                st.session_state.messages = collections.deque([initial_msg], maxlen=MAX_MESSAGES)
+
+                st.success("Tutor generated successfully! You can now start chatting below.")
+                st.balloons()
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+                st.info("Please check your API key and ensure it has access to the Gemini 1.5 Pro model.")
 
 # --- Chat Interface ---
-if "messages" in st.session_state:
+# A fragment, so widgets in the chat panel rerun only the chat rather than the sidebar and uploader too
+@st.fragment
+def chat_fragment():
     st.header("💬 Chat with Your Tutor")
-    
-    # Display existing messages
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
-
-    # Get new user input
-    if prompt := st.chat_input("Ask your tutor for a quiz, or answer its questions..."):
-        # Add user message to session state and display it
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
+    restore_interrupted_send(st.session_state.gemini_chat)
+
+    # Display existing messages. Older ones are skipped unless asked for: an expander would
+    # still send their Markdown on every run even while collapsed.
+    messages = st.session_state.messages
+    older_count = max(0, len(messages) - RECENT_MESSAGES)
+    # The toggle's label and help stay fixed, since both feed its widget ID; the count goes alongside
+    if older_count:
+        show_earlier = st.toggle("Show earlier messages", key="show_earlier")
+        if show_earlier:
+            for msg in itertools.islice(messages, older_count):
+                render_message(msg)
+        else:
+            st.caption(f"{older_count} earlier messages hidden")
+    for msg in itertools.islice(messages, older_count, None):
+        render_message(msg)
+
+    # Send whatever is still waiting for a reply. Text from a send that a rerun interrupted
+    # is still pending here, so it is sent again, joined with any newer input.
+    if st.session_state.pending_input:
+        pending_text = "\n\n".join(st.session_state.pending_input)
 
         # Send message to Gemini and get response
         try:
+            if st.session_state.materials_cache is not None:
+                refresh_materials_cache(st.session_state.gemini_api_key)
             chat_session = st.session_state.gemini_chat
-            with st.spinner("The tutor is thinking..."):
-                response = chat_session.send_message(prompt)
-            
-            # Add AI response to session state and display it
-            st.session_state.messages.append({"role": "assistant", "content": response.text})
-            with st.chat_message("assistant"):
-                st.markdown(response.text)
+            st.session_state.history_before_send = list(chat_session.history)
+            st.session_state.send_in_flight = True
+            # Display the AI response as it streams in, then add it to session state
+            reply_msg = stream_reply(
+                chat_session, pending_text, st.chat_message("assistant"), st.session_state.gemini_api_key
+            )
+            st.session_state.send_in_flight = False
+            st.session_state.messages.append(reply_msg)
+            st.session_state.pending_input = []
+
+            # Keep the history resent on the next turn bounded
+            trim_history(chat_session, st.session_state.gemini_model)
 
         except Exception as e:
+            st.session_state.pending_input = []
             st.error(f"An error occurred while communicating with the AI: {e}")
+
+if "messages" in st.session_state:
+    chat_fragment()
+
+    # Get new user input. The input lives outside the fragment so it stays pinned to the bottom
+    # of the page; queue_chat_input hands the text to the fragment through session state.
+    st.chat_input(
+        "Ask your tutor for a quiz, or answer its questions...",
+        key="chat_input",
+        on_submit=queue_chat_input
+    )